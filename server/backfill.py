@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, List
+
+import clients
+from config import Config
+from scheduler import scheduler, estimate_tokens, EMBEDDING
+
+# Offline pipeline: drains the memory spool and (re-)embeds every `memories` row whose vector is
+# missing or was produced by another EMBEDDING_MODEL / EMBEDDING_VERSION.
+# Requires migrations 001-003.
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - [BACKFILL] - %(message)s')
+logger = logging.getLogger("backfill")
+
+COLUMNS = ("id", "role", "content", "created_at")
+MAX_RETRIES = 5
+# Rows that could not be embedded even one by one; recorded here and skipped
+FAILED_LOG = "backfill_failed.jsonl"
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """
+    Resumes from the last fully written id, unless the target model/version changed since.
+    """
+    fresh = {"model": Config.EMBEDDING_MODEL, "version": Config.EMBEDDING_VERSION, "last_id": 0, "processed": 0}
+    if not os.path.exists(path):
+        return fresh
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("model") != fresh["model"] or checkpoint.get("version") != fresh["version"]:
+        return fresh
+    return checkpoint
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    # Write-then-rename so a crash never leaves a truncated checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+def _insert_spooled(db, rows: List[Dict[str, Any]]):
+    db.table("memories").upsert(rows, on_conflict="client_id", ignore_duplicates=True).execute()
+
+def drain_spool(db, page_size: int) -> int:
+    """
+    Inserts memory rows that AlphredMemory.store could not write. They land without a vector
+    and are embedded by the main pass. Rows carry a client_id and are upserted on it, so
+    re-running after a partial drain never duplicates them.
+    """
+    path = Config.MEMORY_SPOOL_PATH
+    processing = f"{path}.processing"
+    if os.path.exists(path) and not os.path.exists(processing):
+        os.replace(path, processing)
+    if not os.path.exists(processing):
+        return 0
+
+    count = 0
+    batch: List[Dict[str, Any]] = []
+    with open(processing, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not row.get("client_id"):
+                # Spool lines written before client ids existed: derive a stable id from the content
+                row["client_id"] = str(uuid.uuid5(uuid.NAMESPACE_URL, line.strip()))
+            row.update({"embedding": None, "embedding_model": None, "embedding_version": None})
+            batch.append(row)
+            if len(batch) >= page_size:
+                _insert_spooled(db, batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        _insert_spooled(db, batch)
+        count += len(batch)
+    os.remove(processing)
+    return count
+
+def fetch_page(db, last_id: int, page_size: int, reembed_all: bool) -> List[Dict[str, Any]]:
+    """
+    Keyset pagination on id, so only one page is ever held in memory. Rows without any
+    non-whitespace content cannot be embedded and are never selected; archived rows, which
+    match_memories never searches, are only selected with --all.
+    """
+    query = db.table("memories").select(*COLUMNS).gt("id", last_id).filter("content", "match", r"\S")
+    if not reembed_all:
+        query = query.eq("archived", False).or_(
+            f'embedding.is.null,embedding_model.is.null,embedding_version.is.null,'
+            f'embedding_model.neq."{Config.EMBEDDING_MODEL}",embedding_version.neq.{Config.EMBEDDING_VERSION}'
+        )
+    return query.order("id").limit(page_size).execute().data
+
+async def _embed(texts: List[str], semaphore: asyncio.Semaphore, retries: int) -> List[List[float]]:
+    delay = 2.0
+    for attempt in range(1, retries + 1):
+        async with semaphore:
+            await scheduler.aacquire(Config.EMBEDDING_MODEL, estimate_tokens(texts), EMBEDDING)
+            try:
+                res = await clients.aembedding(model=Config.EMBEDDING_MODEL, input=texts)
+                await scheduler.aobserve(Config.EMBEDDING_MODEL, res)
+                return [item["embedding"] for item in res.data]
+            except Exception as e:
+                scheduler.observe_error(Config.EMBEDDING_MODEL, e)
+                if attempt == retries:
+                    raise
+                logger.warning(f"Embedding request failed (attempt {attempt}): {e}")
+        await asyncio.sleep(delay)
+        delay *= 2
+
+def record_failure(row: Dict[str, Any], reason: str):
+    with open(FAILED_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": row["id"], "reason": reason}, ensure_ascii=False) + "\n")
+
+def _embedded(row: Dict[str, Any], vec: List[float]) -> Dict[str, Any]:
+    return {**row, "embedding": vec,
+            "embedding_model": Config.EMBEDDING_MODEL, "embedding_version": Config.EMBEDDING_VERSION}
+
+async def embed_batch(rows: List[Dict[str, Any]], semaphore: asyncio.Semaphore) -> List[Dict[str, Any]]:
+    """
+    Embeds a batch in one request. If the batch keeps failing (e.g. one input the provider
+    rejects), falls back to one request per row; rows that still fail are recorded and skipped
+    so a single bad row cannot block the migration.
+    """
+    # fetch_page already excludes empty content; guard against rows edited since
+    valid = [row for row in rows if (row["content"] or "").strip()]
+    if not valid:
+        return []
+
+    try:
+        vectors = await _embed([r["content"] for r in valid], semaphore, MAX_RETRIES)
+        return [_embedded(row, vec) for row, vec in zip(valid, vectors)]
+    except Exception as e:
+        logger.warning(f"Batch of {len(valid)} failed, retrying row by row: {e}")
+
+    results = []
+    for row in valid:
+        try:
+            vec = (await _embed([row["content"]], semaphore, 2))[0]
+            results.append(_embedded(row, vec))
+        except Exception as e:
+            record_failure(row, str(e))
+    return results
+
+async def run(args):
+    db = clients.get_supabase()
+    if not args.skip_spool:
+        logger.info(f"Drained {drain_spool(db, args.page_size)} spooled rows")
+
+    checkpoint = {"model": Config.EMBEDDING_MODEL, "version": Config.EMBEDDING_VERSION, "last_id": 0, "processed": 0} \
+        if args.reset else load_checkpoint(args.checkpoint)
+    logger.info(f"Starting after id {checkpoint['last_id']} ({checkpoint['processed']} rows done) "
+                f"-> {Config.EMBEDDING_MODEL} v{Config.EMBEDDING_VERSION}")
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    while True:
+        page = await asyncio.to_thread(fetch_page, db, checkpoint["last_id"], args.page_size, args.all)
+        if not page:
+            break
+
+        batches = [page[i:i + args.batch_size] for i in range(0, len(page), args.batch_size)]
+        results = await asyncio.gather(*(embed_batch(b, semaphore) for b in batches))
+        rows = [row for batch in results for row in batch]
+        if rows:
+            await asyncio.to_thread(lambda: db.table("memories").upsert(rows, on_conflict="id").execute())
+
+        # Checkpoint only after the whole page is written, so a restart never skips rows
+        checkpoint["last_id"] = page[-1]["id"]
+        checkpoint["processed"] += len(page)
+        save_checkpoint(args.checkpoint, checkpoint)
+        logger.info(f"Re-embedded {checkpoint['processed']} rows (last id {checkpoint['last_id']})")
+
+    logger.info(f"Done. {checkpoint['processed']} rows re-embedded.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Alphred memory backfill / re-embedding pipeline")
+    parser.add_argument("--batch-size", type=int, default=100, help="Texts per embedding request")
+    parser.add_argument("--page-size", type=int, default=1000, help="Rows fetched and upserted per page")
+    parser.add_argument("--concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    parser.add_argument("--all", action="store_true", help="Re-embed every row, not only stale ones")
+    parser.add_argument("--reset", action="store_true", help="Ignore the existing checkpoint")
+    parser.add_argument("--skip-spool", action="store_true", help="Do not drain the memory spool first")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
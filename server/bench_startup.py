@@ -0,0 +1,77 @@
+"""
+Startup-time benchmark for the Concierge server.
+
+Measures, over several cold runs:
+  - import: time to `import server` in a fresh interpreter
+  - healthz: time from process launch until /healthz answers (accepting traffic)
+  - readyz: time from process launch until /readyz reports ready (warm-up finished)
+
+Usage:
+    python bench_startup.py --runs 5 --port 8765
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def wait_for(url: str, start: float, timeout: float) -> float:
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1.0) as res:
+                if res.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+def measure_server(port: int, timeout: float):
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE,
+    )
+    try:
+        healthz = wait_for(f"{base}/healthz", start, timeout)
+        readyz = wait_for(f"{base}/readyz", start, timeout)
+        return healthz, readyz
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def report(name: str, samples):
+    print(f"{name:<8} median={statistics.median(samples) * 1000:8.1f} ms  "
+          f"min={min(samples) * 1000:8.1f} ms  max={max(samples) * 1000:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Alphred server startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    imports, healthz, readyz = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        h, r = measure_server(args.port, args.timeout)
+        healthz.append(h)
+        readyz.append(r)
+
+    report("import", imports)
+    report("healthz", healthz)
+    report("readyz", readyz)
+
+if __name__ == "__main__":
+    main()
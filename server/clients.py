@@ -0,0 +1,63 @@
+import logging
+import threading
+import warnings
+from typing import Any
+
+from config import Config
+
+# litellm / supabase are slow to import (hundreds of ms each), so they are
+# loaded on first use instead of at module import time.
+_lock = threading.Lock()
+_litellm = None
+_supabase = None
+
+def get_litellm():
+    """
+    Imports and configures litellm on first use.
+    """
+    global _litellm
+    if _litellm is None:
+        with _lock:
+            if _litellm is None:
+                warnings.filterwarnings("ignore")
+                import litellm
+                logging.getLogger("litellm").setLevel(logging.ERROR)
+                litellm.telemetry = False
+                litellm.drop_params = True
+                _litellm = litellm
+    return _litellm
+
+def get_supabase():
+    """
+    Creates the shared Supabase client on first use.
+    """
+    global _supabase
+    if _supabase is None:
+        with _lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_SECRET_KEY)
+    return _supabase
+
+def completion(**kwargs) -> Any:
+    return get_litellm().completion(**kwargs)
+
+async def acompletion(**kwargs) -> Any:
+    return await get_litellm().acompletion(**kwargs)
+
+def embedding(**kwargs) -> Any:
+    return get_litellm().embedding(**kwargs)
+
+async def aembedding(**kwargs) -> Any:
+    return await get_litellm().aembedding(**kwargs)
+
+def warm_up():
+    """
+    Loads the heavy client modules and opens the Supabase connection.
+    Intended to run in a background thread during startup.
+    """
+    get_litellm()
+    client = get_supabase()
+    # Cheap round-trip so the HTTP connection pool is open before the first request.
+    # Errors propagate: an unreachable database must not report the providers as ready.
+    client.table("memories").select("id").limit(1).execute()
@@ -0,0 +1,53 @@
+import json
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class Config:
+    SUPABASE_URL = os.getenv("SUPABASE_URL")
+    SUPABASE_SECRET_KEY = os.getenv("SUPABASE_SECRET_KEY")
+    ACCESS_TOKEN = os.getenv("ALPHRED_ACCESS_TOKEN")
+    DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "groq/llama-3.3-70b-versatile")
+    GEMINI_MODEL = "gemini/gemini-1.5-flash"
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini/text-embedding-004")
+    # Bump when the embedding input format changes; backfill.py re-embeds rows with another model/version
+    EMBEDDING_VERSION = int(os.getenv("EMBEDDING_VERSION", "1"))
+    SEARCH_THRESHOLD = 0.35
+    # Skill activated by the Concierge at startup
+    STARTUP_SKILL = os.getenv("ALPHRED_STARTUP_SKILL", "task_manager")
+    # Seconds /chat waits for startup warm-up before answering 503
+    READY_TIMEOUT = float(os.getenv("ALPHRED_READY_TIMEOUT", "10"))
+    # Candidate chat models for the latency-aware router (first = preferred when no stats yet)
+    ROUTER_MODELS = [DEFAULT_MODEL, GEMINI_MODEL]
+    # Send a hedged duplicate for interactive /chat requests after a p90-based delay
+    HEDGE_REQUESTS = os.getenv("ALPHRED_HEDGE_REQUESTS", "true").lower() == "true"
+    # Client-side rate limits (requests / tokens per minute); override with ALPHRED_RATE_LIMITS (JSON)
+    RATE_LIMITS = {
+        "groq/llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000},
+        "gemini/gemini-1.5-flash": {"rpm": 15, "tpm": 1000000},
+        "gemini/text-embedding-004": {"rpm": 1500, "tpm": 1000000},
+        **json.loads(os.getenv("ALPHRED_RATE_LIMITS", "{}")),
+    }
+    DEFAULT_RATE_LIMIT = {"rpm": 60, "tpm": 100000}
+    # Threads per dedicated memory pool (retrieval / store) in the server
+    MEMORY_THREADS = int(os.getenv("ALPHRED_MEMORY_THREADS", "4"))
+    # Long-term memory consolidation (consolidation.py)
+    CONSOLIDATE_AFTER_DAYS = int(os.getenv("ALPHRED_CONSOLIDATE_AFTER_DAYS", "30"))
+    CONSOLIDATION_INTERVAL = int(os.getenv("ALPHRED_CONSOLIDATION_INTERVAL", "3600"))
+    DEDUP_THRESHOLD = 0.97
+    TOPIC_THRESHOLD = 0.75
+    CONSOLIDATION_MAX_ATTEMPTS = 3
+    # Leader claim per pass, renewed before each window; must outlast consolidating one window
+    CONSOLIDATION_LEADER_TTL = 900
+    # Shared state (STM, caches, claims): "memory" (single process) or "sqlite:///path/to/state.db"
+    STATE_BACKEND = os.getenv("ALPHRED_STATE_BACKEND", "memory")
+    STM_MAXLEN = 10
+    STM_PRELOAD_TTL = 3600
+    TASK_CLAIM_TTL = 1800
+    # Memory writes that could not reach the database are buffered here until backfill.py drains them
+    MEMORY_SPOOL_PATH = os.getenv("ALPHRED_MEMORY_SPOOL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_spool.jsonl"))
+    # Tools sent per request when a skill exposes more than this (plus pinned tools)
+    TOOL_TOP_K = int(os.getenv("ALPHRED_TOOL_TOP_K", "8"))
+    # Tool-call rounds per /chat request before answering from the results so far
+    CHAT_MAX_TURNS = int(os.getenv("ALPHRED_CHAT_MAX_TURNS", "5"))
@@ -0,0 +1,272 @@
+import argparse
+import datetime
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import clients
+from clients import completion
+from config import Config
+from memory import AlphredMemory
+from scheduler import scheduler, estimate_tokens, BACKGROUND
+from state import state_backend
+
+# Background job: folds old per-message memories into embedded summary records.
+# Requires migrations/001_memory_consolidation.sql.
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - [CONSOLIDATION] - %(message)s')
+logger = logging.getLogger("consolidation")
+
+PAGE_SIZE = 1000
+UPDATE_CHUNK = 200
+# High-water mark: windows before it have been scanned. Persists across restarts with a shared state backend.
+CURSOR_KEY = "consolidation:cursor"
+# Windows where a summary failed: {window_start_iso: attempts}
+RETRY_KEY = "consolidation:retry"
+# Only one process (e.g. one per replica) consolidates at a time
+LEADER_KEY = "consolidation:leader"
+
+def _vector(value) -> Optional[List[float]]:
+    # PostgREST returns pgvector columns as a JSON string
+    if value is None:
+        return None
+    return json.loads(value) if isinstance(value, str) else value
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _live_messages(db):
+    return db.table("memories").select("id", "role", "content", "created_at", "embedding") \
+        .eq("kind", "message").eq("archived", False)
+
+def oldest_pending(db, after: datetime.datetime, cutoff: datetime.datetime) -> Optional[datetime.datetime]:
+    res = db.table("memories").select("created_at").eq("kind", "message").eq("archived", False) \
+        .gte("created_at", after.isoformat()).lt("created_at", cutoff.isoformat()) \
+        .order("created_at").limit(1).execute()
+    if not res.data:
+        return None
+    return datetime.datetime.fromisoformat(res.data[0]["created_at"])
+
+def fetch_window(db, start: datetime.datetime, end: datetime.datetime) -> List[Dict[str, Any]]:
+    rows = []
+    offset = 0
+    while True:
+        res = _live_messages(db).gte("created_at", start.isoformat()).lt("created_at", end.isoformat()) \
+            .order("created_at").range(offset, offset + PAGE_SIZE - 1).execute()
+        for row in res.data:
+            row["embedding"] = _vector(row.get("embedding"))
+        rows.extend(res.data)
+        if len(res.data) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+def dedupe(rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[Any, List[Any]]]:
+    """
+    Splits rows into survivors and near-duplicates (same role, cosine >= DEDUP_THRESHOLD).
+    Returns (kept_rows, {kept_id: [duplicate_ids]}).
+    """
+    kept: List[Dict[str, Any]] = []
+    duplicates: Dict[Any, List[Any]] = {}
+    for row in rows:
+        vec = row["embedding"]
+        match = None
+        if vec is not None:
+            for other in kept:
+                if other["role"] == row["role"] and other["embedding"] is not None \
+                        and _cosine(vec, other["embedding"]) >= Config.DEDUP_THRESHOLD:
+                    match = other
+                    break
+        if match:
+            duplicates.setdefault(match["id"], []).append(row["id"])
+        else:
+            kept.append(row)
+    return kept, duplicates
+
+def cluster(rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Greedy topic clustering against running centroids. Singletons and rows without an
+    embedding are pooled into one trailing 'misc' cluster.
+    """
+    clusters: List[Tuple[List[float], List[Dict[str, Any]]]] = []
+    misc: List[Dict[str, Any]] = []
+    for row in rows:
+        vec = row["embedding"]
+        if vec is None:
+            misc.append(row)
+            continue
+        best, best_sim = None, Config.TOPIC_THRESHOLD
+        for centroid, members in clusters:
+            sim = _cosine(vec, centroid)
+            if sim >= best_sim:
+                best, best_sim = (centroid, members), sim
+        if best is None:
+            clusters.append((list(vec), [row]))
+        else:
+            centroid, members = best
+            members.append(row)
+            for i, x in enumerate(vec):
+                centroid[i] += (x - centroid[i]) / len(members)
+
+    groups = []
+    for _, members in clusters:
+        if len(members) > 1:
+            groups.append(members)
+        else:
+            misc.extend(members)
+    if len(misc) > 1:
+        groups.append(sorted(misc, key=lambda r: r["created_at"]))
+    return groups
+
+def summarize(rows: List[Dict[str, Any]]) -> Optional[str]:
+    transcript = "\n".join(
+        AlphredMemory.format_memory_content(r["created_at"], r["role"], r["content"]) for r in rows
+    )
+    messages = [
+        {"role": "system", "content": (
+            "다음 대화 기록을 장기 기억용으로 요약하세요.\n"
+            "- 사실, 결정, 선호, 일정, 프로젝트 정보는 구체적으로 보존하세요.\n"
+            "- 인사나 잡담은 생략하세요.\n"
+            "- 요약문만 출력하세요."
+        )},
+        {"role": "user", "content": transcript},
+    ]
+    try:
+        scheduler.acquire(Config.GEMINI_MODEL, estimate_tokens(messages, completion_tokens=512), BACKGROUND)
+        res = completion(model=Config.GEMINI_MODEL, messages=messages)
+        scheduler.observe(Config.GEMINI_MODEL, res)
+        return (res.choices[0].message.content or "").strip() or None
+    except Exception as e:
+        scheduler.observe_error(Config.GEMINI_MODEL, e)
+        logger.error(f"Summarize failed: {e}")
+        return None
+
+def _archive(db, ids: List[Any], into: Any):
+    for i in range(0, len(ids), UPDATE_CHUNK):
+        db.table("memories").update({"archived": True, "consolidated_into": into}) \
+            .in_("id", ids[i:i + UPDATE_CHUNK]).execute()
+
+def consolidate_window(db, start: datetime.datetime, end: datetime.datetime) -> Dict[str, int]:
+    stats = {"rows": 0, "duplicates": 0, "summaries": 0, "archived": 0, "failed": 0}
+    rows = fetch_window(db, start, end)
+    stats["rows"] = len(rows)
+
+    kept, duplicates = dedupe(rows)
+    for kept_id, dup_ids in duplicates.items():
+        _archive(db, dup_ids, kept_id)
+        stats["duplicates"] += len(dup_ids)
+
+    for group in cluster(kept):
+        summary = summarize(group)
+        vec = AlphredMemory.get_embedding(summary) if summary else None
+        if not vec:
+            stats["failed"] += 1
+            continue
+        period_start, period_end = group[0]["created_at"], group[-1]["created_at"]
+        res = db.table("memories").insert({
+            "role": "Summary",
+            "content": summary,
+            "embedding": vec,
+            "embedding_model": Config.EMBEDDING_MODEL,
+            "embedding_version": Config.EMBEDDING_VERSION,
+            "kind": "summary",
+            "created_at": period_start,
+            "period_start": period_start,
+            "period_end": period_end,
+            "source_count": len(group),
+        }).execute()
+        _archive(db, [r["id"] for r in group], res.data[0]["id"])
+        stats["summaries"] += 1
+        stats["archived"] += len(group)
+    return stats
+
+def _window(start: datetime.datetime, cutoff: datetime.datetime) -> Tuple[datetime.datetime, datetime.datetime]:
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, min(start + datetime.timedelta(days=1), cutoff)
+
+def run_once(older_than_days: int = None, rescan: bool = False) -> Optional[Dict[str, int]]:
+    """
+    Consolidates day-sized windows older than the cutoff, oldest first, starting from the saved
+    cursor. Leftover singletons stay live and are not re-scanned; windows where summarizing failed
+    are retried on the next passes up to CONSOLIDATION_MAX_ATTEMPTS times.
+    Returns None without doing anything if another process holds the leader claim.
+    """
+    if not state_backend.claim(LEADER_KEY, ttl=Config.CONSOLIDATION_LEADER_TTL):
+        return None
+    try:
+        return _run_pass(older_than_days, rescan)
+    finally:
+        state_backend.release(LEADER_KEY)
+
+def _run_pass(older_than_days: Optional[int], rescan: bool) -> Dict[str, int]:
+    db = clients.get_supabase()
+    days = older_than_days if older_than_days is not None else Config.CONSOLIDATE_AFTER_DAYS
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    totals = {"rows": 0, "duplicates": 0, "summaries": 0, "archived": 0, "failed": 0}
+
+    def run_window(start, end):
+        # Renew the leader claim; if it expired and another process took over, stop here
+        if not state_backend.claim(LEADER_KEY, ttl=Config.CONSOLIDATION_LEADER_TTL):
+            raise RuntimeError("Lost the consolidation leader claim")
+        stats = consolidate_window(db, start, end)
+        logger.info(f"Window {start.date()}: {stats}")
+        for key in totals:
+            totals[key] += stats[key]
+        return stats
+
+    # 1. Retry windows that failed in earlier passes
+    retries: Dict[str, int] = state_backend.cache_get(RETRY_KEY) or {}
+    for start_iso, attempts in list(retries.items()):
+        stats = run_window(*_window(datetime.datetime.fromisoformat(start_iso), cutoff))
+        if not stats["failed"]:
+            del retries[start_iso]
+        elif attempts + 1 >= Config.CONSOLIDATION_MAX_ATTEMPTS:
+            logger.warning(f"Giving up on window {start_iso} after {attempts + 1} attempts")
+            del retries[start_iso]
+        else:
+            retries[start_iso] = attempts + 1
+        state_backend.cache_set(RETRY_KEY, retries)
+
+    # 2. New windows past the cursor
+    saved = None if rescan else state_backend.cache_get(CURSOR_KEY)
+    cursor = datetime.datetime.fromisoformat(saved) if saved else datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    while True:
+        oldest = oldest_pending(db, cursor, cutoff)
+        if oldest is None:
+            break
+        start, end = _window(oldest, cutoff)
+        if run_window(start, end)["failed"]:
+            retries[start.isoformat()] = 1
+            state_backend.cache_set(RETRY_KEY, retries)
+        cursor = end
+        state_backend.cache_set(CURSOR_KEY, cursor.isoformat())
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Alphred long-term memory consolidation")
+    parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    parser.add_argument("--older-than-days", type=int, default=Config.CONSOLIDATE_AFTER_DAYS)
+    parser.add_argument("--interval", type=int, default=Config.CONSOLIDATION_INTERVAL, help="Seconds between passes")
+    parser.add_argument("--rescan", action="store_true", help="Ignore the saved cursor and scan from the oldest memory")
+    args = parser.parse_args()
+
+    rescan = args.rescan
+    while True:
+        try:
+            totals = run_once(args.older_than_days, rescan=rescan)
+            if totals is None:
+                logger.info("Another process is consolidating; skipping this pass")
+            else:
+                logger.info(f"Pass complete: {totals}")
+                rescan = False
+        except Exception as e:
+            logger.error(f"Pass failed: {e}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 import asyncio
 import os
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+if TYPE_CHECKING:
+    from mcp import ClientSession
 
 class MCPClientSession:
     """
@@ -14,7 +14,7 @@ class MCPClientSession:
         self.command = command
         self.args = args or []
         self.env = env or os.environ.copy()
-        self.session: Optional[ClientSession] = None
+        self.session: Optional["ClientSession"] = None
         self._exit_stack = None
 
     @asynccontextmanager
@@ -22,6 +22,10 @@ class MCPClientSession:
         """
         Connects to the MCP server and yields the session.
         """
+        # Imported here so servers that never activate an MCP skill don't pay for it
+        from mcp import ClientSession, StdioServerParameters
+        from mcp.client.stdio import stdio_client
+
         server_params = StdioServerParameters(
             command=self.command,
             args=self.args,
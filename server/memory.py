@@ -0,0 +1,141 @@
+import json
+import datetime
+import threading
+import uuid
+
+import clients
+from clients import completion, embedding
+from config import Config
+from scheduler import scheduler, estimate_tokens, INTERACTIVE, EMBEDDING
+from state import state_backend
+
+# --- Alphred 메모리 엔진 ---
+
+class AlphredMemory:
+    # STM lives in the state backend so every uvicorn worker / replica shares one conversation view
+    state = state_backend
+    _spool_lock = threading.Lock()
+
+    @staticmethod
+    def format_memory_content(timestamp, role, content) -> str:
+        """
+        Formats memory unified: [YYYY-MM-DD HH:MM:ss] Role: Content
+        Parses ISO timestamp if string.
+        """
+        try:
+            if isinstance(timestamp, str):
+                dt = datetime.datetime.fromisoformat(timestamp)
+            else:
+                dt = timestamp
+            ts_str = dt.strftime("%Y-%m-%d %H:%M:%S")
+        except:
+            ts_str = str(timestamp)
+            
+        # Normalize role for display
+        if role.lower() == "user":
+            display_role = "User"
+        elif role.lower() == "summary":
+            display_role = "Summary"
+        else:
+            display_role = "AI"
+        return f"[{ts_str}] {display_role}: {content}"
+
+    @staticmethod
+    def get_context():
+        return AlphredMemory.state.get_context(Config.STM_MAXLEN)
+
+    @staticmethod
+    def initialize_cache():
+        # With a shared backend only one process per preload interval reloads STM from the database
+        if not AlphredMemory.state.claim("stm:preload", ttl=Config.STM_PRELOAD_TTL):
+            return
+        try:
+            res = clients.get_supabase().table("memories").select("role", "content", "created_at").eq("kind", "message").order("created_at", desc=True).limit(50).execute()
+            entries = []
+            for h in res.data[::-1]:
+                role = "user" if h['role'] in ["User", "user"] else "assistant"
+                # STM Format: [Time] Role: Content
+                formatted_content = AlphredMemory.format_memory_content(h['created_at'], role, h['content'])
+                entries.append({"role": role, "content": formatted_content})
+            AlphredMemory.state.replace_context(entries, Config.STM_MAXLEN)
+        except Exception as e:
+            AlphredMemory.state.release("stm:preload")
+            print(f"[Memory Init Error] {e}")
+            raise
+
+    @staticmethod
+    def get_embedding(text, priority=EMBEDDING):
+        try:
+            scheduler.acquire(Config.EMBEDDING_MODEL, estimate_tokens(text), priority)
+            res = embedding(model=Config.EMBEDDING_MODEL, input=[text])
+            scheduler.observe(Config.EMBEDDING_MODEL, res)
+            return res.data[0]['embedding']
+        except Exception as e:
+            scheduler.observe_error(Config.EMBEDDING_MODEL, e)
+            return None
+
+    @staticmethod
+    def retrieve_long_term(query, vec=None):
+        # `vec`: the query embedding, if the caller already computed it
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            scheduler.acquire(Config.GEMINI_MODEL, estimate_tokens(query, completion_tokens=64), INTERACTIVE)
+            it_res = completion(
+                model=Config.GEMINI_MODEL,
+                messages=[{"role": "system", "content": f"현재 시간 {now}. 시간범위를 JSON으로 분석."},
+                          {"role": "user", "content": query}],
+                response_format={"type": "json_object"}
+            )
+            it = json.loads(it_res.choices[0].message.content)
+            vec = vec or AlphredMemory.get_embedding(query, priority=INTERACTIVE)
+            if not vec: return ""
+            res = clients.get_supabase().rpc("match_memories", {
+                "query_embedding": vec, "match_threshold": Config.SEARCH_THRESHOLD, "match_count": 5,
+                "query_model": Config.EMBEDDING_MODEL,
+                "from_date": it.get("from_date", "-infinity"), "to_date": it.get("to_date", "infinity")
+            }).execute()
+            if not res.data: return ""
+            ctx = "\n[관련된 장기 기억 기록]\n"
+            for m in res.data:
+                # LTM Format: [Time] Role: Content
+                line = AlphredMemory.format_memory_content(m['created_at'], m['role'], m['content'])
+                ctx += f"- {line}\n"
+            return ctx
+        except: return ""
+
+    @staticmethod
+    def store(role, content):
+        # Database: Store raw content
+        now = datetime.datetime.now()
+
+        # Cache: Store formatted content (before embedding, so STM never waits on the embedding queue)
+        cache_role = "user" if role in ["User", "user"] else "assistant"
+        formatted_content = AlphredMemory.format_memory_content(now, cache_role, content)
+        AlphredMemory.state.append_context({"role": cache_role, "content": formatted_content}, Config.STM_MAXLEN)
+
+        vec = AlphredMemory.get_embedding(content)
+        
+        # Rows whose embedding failed are stored with a NULL vector and re-embedded by backfill.py,
+        # so a provider outage never loses conversation history.
+        row = {
+            # Client-side id so a spooled row can be re-inserted idempotently
+            "client_id": str(uuid.uuid4()),
+            "role": role, 
+            "content": content,  # Raw content in DB
+            "embedding": vec, 
+            "embedding_model": Config.EMBEDDING_MODEL if vec else None,
+            "embedding_version": Config.EMBEDDING_VERSION if vec else None,
+            "created_at": now.isoformat()
+        }
+        try: clients.get_supabase().table("memories").insert(row).execute()
+        except Exception as e:
+            print(f"[Memory Store Error] {e}; spooling to {Config.MEMORY_SPOOL_PATH}")
+            AlphredMemory.spool(row)
+
+    @staticmethod
+    def spool(row):
+        try:
+            with AlphredMemory._spool_lock, open(Config.MEMORY_SPOOL_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps({k: v for k, v in row.items() if k != "embedding"}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"[Memory Spool Error] {e}")
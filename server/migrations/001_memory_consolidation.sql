@@ -0,0 +1,43 @@
+-- Long-term memory consolidation (run once in the Supabase SQL Editor)
+-- Adds summary records and archiving to `memories`, and makes match_memories search only live rows.
+
+alter table memories add column if not exists kind text not null default 'message';  -- 'message' | 'summary'
+alter table memories add column if not exists archived boolean not null default false;
+alter table memories add column if not exists consolidated_into bigint references memories(id) on delete set null;
+alter table memories add column if not exists period_start timestamptz;  -- summaries only
+alter table memories add column if not exists period_end timestamptz;    -- summaries only
+alter table memories add column if not exists source_count int;          -- summaries only
+
+-- Consolidation job scans old, live messages in time order
+create index if not exists memories_consolidation_idx
+    on memories (created_at)
+    where kind = 'message' and not archived;
+
+-- Vector index covers live rows only, so search cost tracks the consolidated size, not the raw history
+create index if not exists memories_live_embedding_idx
+    on memories using hnsw (embedding vector_cosine_ops)
+    where not archived;
+
+drop function if exists match_memories;
+
+create function match_memories(
+    query_embedding vector(768),
+    match_threshold float,
+    match_count int,
+    from_date timestamptz default '-infinity',
+    to_date timestamptz default 'infinity'
+)
+returns table (id bigint, role text, content text, created_at timestamptz, kind text, similarity float)
+language sql stable
+as $$
+    -- Archived originals are replaced by their summary, so old ranges resolve to consolidated records
+    select m.id, m.role, m.content, m.created_at, m.kind,
+           1 - (m.embedding <=> query_embedding) as similarity
+    from memories m
+    where not m.archived
+      and coalesce(m.period_end, m.created_at) >= from_date
+      and coalesce(m.period_start, m.created_at) <= to_date
+      and 1 - (m.embedding <=> query_embedding) > match_threshold
+    order by m.embedding <=> query_embedding
+    limit match_count;
+$$;
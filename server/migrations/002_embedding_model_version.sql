@@ -0,0 +1,42 @@
+-- Embedding model/version tracking for backfill.py (run once in the Supabase SQL Editor, after 001)
+
+alter table memories alter column embedding drop not null;
+alter table memories add column if not exists embedding_model text;
+alter table memories add column if not exists embedding_version int;
+
+-- Existing vectors were produced by the original default model
+update memories
+set embedding_model = 'gemini/text-embedding-004', embedding_version = 1
+where embedding is not null and embedding_model is null;
+
+-- Lets backfill.py find rows that still need (re-)embedding without a full scan
+create index if not exists memories_backfill_idx
+    on memories (id, embedding_model, embedding_version);
+
+drop function if exists match_memories;
+
+create function match_memories(
+    query_embedding vector(768),
+    match_threshold float,
+    match_count int,
+    from_date timestamptz default '-infinity',
+    to_date timestamptz default 'infinity',
+    query_model text default null
+)
+returns table (id bigint, role text, content text, created_at timestamptz, kind text, similarity float)
+language sql stable
+as $$
+    -- Archived originals are replaced by their summary, so old ranges resolve to consolidated records.
+    -- Vectors from another embedding model are not comparable and are skipped until re-embedded.
+    select m.id, m.role, m.content, m.created_at, m.kind,
+           1 - (m.embedding <=> query_embedding) as similarity
+    from memories m
+    where not m.archived
+      and m.embedding is not null
+      and (query_model is null or m.embedding_model = query_model)
+      and coalesce(m.period_end, m.created_at) >= from_date
+      and coalesce(m.period_start, m.created_at) <= to_date
+      and 1 - (m.embedding <=> query_embedding) > match_threshold
+    order by m.embedding <=> query_embedding
+    limit match_count;
+$$;
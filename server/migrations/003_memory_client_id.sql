@@ -0,0 +1,5 @@
+-- Client-side row ids so backfill.py can re-drain the memory spool idempotently (run once in the Supabase SQL Editor, after 002)
+
+alter table memories add column if not exists client_id uuid;
+
+create unique index if not exists memories_client_id_key on memories (client_id);
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import clients
+from scheduler import scheduler, estimate_tokens, BACKGROUND
+
+class ProviderStats:
+    """
+    Rolling latency / error window for a single model. Samples older than `max_age` seconds are
+    ignored, so a model that was failing earlier gets a clean slate once it recovers.
+    """
+    def __init__(self, window: int = 50, max_age: float = 300.0, alpha: float = 0.3):
+        self.samples = deque(maxlen=window)  # (recorded_at, latency_seconds, ok, censored)
+        self.max_age = max_age
+        self.alpha = alpha
+        # Exponentially weighted latency, reacts within a few requests when a provider slows down
+        self.ewma: Optional[float] = None
+        self.consecutive_errors = 0
+        self.last_error_at = 0.0
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((time.monotonic(), latency, ok, False))
+        if ok:
+            self._update_ewma(latency)
+            self.consecutive_errors = 0
+        else:
+            self.consecutive_errors += 1
+            self.last_error_at = time.monotonic()
+
+    def record_censored(self, latency: float):
+        """
+        Records a cancelled attempt (lost a hedge race). The true latency is at least `latency`,
+        so it can only raise the estimate: it lifts the EWMA if larger and stays out of the
+        percentiles, which would otherwise shorten this model's hedge delay. It is not an error.
+        """
+        self.samples.append((time.monotonic(), latency, True, True))
+        self.ewma = latency if self.ewma is None else max(self.ewma, latency)
+
+    def _update_ewma(self, latency: float):
+        self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+
+    def _recent(self) -> List[tuple]:
+        horizon = time.monotonic() - self.max_age
+        return [s for s in self.samples if s[0] >= horizon]
+
+    def _latencies(self) -> List[float]:
+        return sorted(lat for _, lat, ok, censored in self._recent() if ok and not censored)
+
+    def percentile(self, p: float) -> Optional[float]:
+        lats = self._latencies()
+        if not lats:
+            return None
+        idx = min(len(lats) - 1, int(round(p * (len(lats) - 1))))
+        return lats[idx]
+
+    @property
+    def error_rate(self) -> float:
+        recent = self._recent()
+        if not recent:
+            return 0.0
+        return sum(1 for _, _, ok, _ in recent if not ok) / len(recent)
+
+    @property
+    def has_samples(self) -> bool:
+        return bool(self._recent())
+
+    @property
+    def has_successes(self) -> bool:
+        # Completed or censored (still running when cancelled) attempts, i.e. not only failures
+        return any(ok for _, _, ok, _ in self._recent())
+
+    def is_healthy(self, max_error_rate: float, cooldown: float) -> bool:
+        # Half-open: once `cooldown` has passed since the last error, let a request probe the model.
+        # A failed probe updates last_error_at and benches it again.
+        if time.monotonic() - self.last_error_at >= cooldown:
+            return True
+        if self.consecutive_errors >= 3:
+            return False
+        recent = self._recent()
+        return len(recent) < 5 or self.error_rate <= max_error_rate
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "ewma": self.ewma,
+            "error_rate": round(self.error_rate, 3),
+            "samples": len(self._recent()),
+        }
+
+class ModelRouter:
+    """
+    Sends each completion to the fastest healthy model and falls back to the next one on failure.
+    With hedge=True, a duplicate request goes to the runner-up model once the primary has been
+    slower than its own p90; whichever answers first wins and the other is cancelled.
+    """
+    def __init__(self, models: List[str], max_error_rate: float = 0.5, cooldown: float = 30.0,
+                 hedge_min_delay: float = 0.5, hedge_max_delay: float = 5.0, hedge_default_delay: float = 2.0):
+        self.models = list(dict.fromkeys(models))
+        self.stats: Dict[str, ProviderStats] = {m: ProviderStats() for m in self.models}
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_default_delay = hedge_default_delay
+
+    def rank(self) -> List[str]:
+        """
+        Healthy models ordered by recent latency (EWMA). Models without samples sort first so they
+        get measured; models with only failures sort after every model that has succeeded.
+        Unhealthy models are kept at the end as a last resort.
+        """
+        def key(model):
+            stats = self.stats[model]
+            if not stats.has_samples:
+                return (0, 0.0, self.models.index(model))
+            if not stats.has_successes:
+                return (2, 0.0, self.models.index(model))
+            return (1, stats.ewma, self.models.index(model))
+
+        healthy = [m for m in self.models if self.stats[m].is_healthy(self.max_error_rate, self.cooldown)]
+        unhealthy = [m for m in self.models if m not in healthy]
+        return sorted(healthy, key=key) + unhealthy
+
+    def hedge_delay(self, model: str) -> float:
+        p90 = self.stats[model].percentile(0.9)
+        if p90 is None:
+            return self.hedge_default_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, p90))
+
+    async def _call(self, model: str, kwargs: Dict[str, Any], priority: int) -> Any:
+        tokens = estimate_tokens(kwargs.get("messages"), kwargs.get("tools"), completion_tokens=kwargs.get("max_tokens") or 512)
+        await scheduler.aacquire(model, tokens, priority)
+        # Latency is measured from dispatch, so client-side queuing doesn't count against the provider
+        start = time.monotonic()
+        try:
+            response = await clients.acompletion(model=model, **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedge race: not a provider failure, but the elapsed time is a lower bound on its latency
+            self.stats[model].record_censored(time.monotonic() - start)
+            raise
+        except Exception as e:
+            scheduler.observe_error(model, e)
+            self.stats[model].record(time.monotonic() - start, ok=False)
+            raise
+        await scheduler.aobserve(model, response)
+        self.stats[model].record(time.monotonic() - start, ok=True)
+        return response
+
+    async def acompletion(self, hedge: bool = False, priority: int = BACKGROUND, **kwargs) -> Any:
+        """
+        Routes a chat completion. kwargs are passed to litellm (messages, tools, ...).
+        Each attempt waits for its model's rate-limit budget at the given scheduler priority.
+        """
+        remaining = self.rank()
+        pending: Dict[asyncio.Task, str] = {}
+        hedged = False
+        last_error: Optional[Exception] = None
+
+        def launch():
+            model = remaining.pop(0)
+            pending[asyncio.create_task(self._call(model, kwargs, priority))] = model
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and not hedged and remaining and len(pending) == 1:
+                    timeout = self.hedge_delay(next(iter(pending.values())))
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary is slower than its p90: fire the hedge
+                    hedged = True
+                    launch()
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"[Router] {model} failed: {last_error}")
+
+                if not pending and remaining:
+                    launch()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {m: self.stats[m].snapshot() for m in self.models}
@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import itertools
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+from state import state_backend
+
+# Lower value = served first
+INTERACTIVE = 0
+BACKGROUND = 1
+EMBEDDING = 2
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget for one model, with a priority queue of waiters.
+
+    The budget itself lives in the state backend, so every process sharing a backend (uvicorn
+    workers, worker.py, consolidation.py, backfill.py) draws from the same per-key limit.
+    Priority ordering applies within a process only: a background process is not held back by
+    interactive traffic queued in another process.
+
+    Async callers wait on the event loop without holding a thread, and backend calls (a SQLite
+    transaction or a Redis round trip) run off the loop; sync callers block their own thread.
+    """
+    def __init__(self, model: str, rpm: float, tpm: float, backend):
+        self.model = model
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self.backend = backend
+        self.paused_until = 0.0
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakers: Dict[tuple, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, tokens: float):
+        return [
+            (f"ratelimit:{self.model}:requests", 1, self.rpm),
+            (f"ratelimit:{self.model}:tokens", tokens, self.tpm),
+        ]
+
+    def _enqueue(self, priority: int, waker: Callable[[], None]) -> tuple:
+        with self._lock:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._queue, entry)
+            self._wakers[entry] = waker
+        self._notify()
+        return entry
+
+    def _dequeue(self, entry: tuple):
+        with self._lock:
+            if entry not in self._wakers:
+                return
+            del self._wakers[entry]
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+        self._notify()
+
+    def _notify(self):
+        with self._lock:
+            wakers = list(self._wakers.values())
+        for wake in wakers:
+            wake()
+
+    def _head_wait(self, entry: tuple) -> Optional[float]:
+        """
+        How long to wait before retrying, or None if `entry` may draw from the budget now.
+        Only the head of the queue draws from the budget.
+        """
+        with self._lock:
+            if self._queue[0] != entry:
+                return 1.0
+            pause = self.paused_until - time.monotonic()
+        return pause if pause > 0 else None
+
+    def _take(self, entry: tuple, tokens: float) -> float:
+        wait = self.backend.take_tokens(self._buckets(tokens))
+        if wait <= 0:
+            self._dequeue(entry)
+        return wait
+
+    def _try_take(self, entry: tuple, tokens: float) -> float:
+        """
+        Returns 0 once `entry` has taken its budget, otherwise how long to wait before retrying.
+        """
+        wait = self._head_wait(entry)
+        return wait if wait is not None else self._take(entry, tokens)
+
+    async def acquire_async(self, tokens: float, priority: int = BACKGROUND):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        entry = self._enqueue(priority, lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while True:
+                event.clear()
+                wait = self._head_wait(entry)
+                if wait is None:
+                    wait = await asyncio.to_thread(self._take, entry, tokens)
+                if wait <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._dequeue(entry)
+
+    def acquire(self, tokens: float, priority: int = BACKGROUND):
+        event = threading.Event()
+        entry = self._enqueue(priority, event.set)
+        try:
+            while True:
+                event.clear()
+                wait = self._try_take(entry, tokens)
+                if wait <= 0:
+                    return
+                event.wait(timeout=min(wait, 1.0))
+        finally:
+            self._dequeue(entry)
+
+    def update(self, headers: Dict[str, str]):
+        """
+        Adjusts limits from provider rate-limit response headers.
+        """
+        for key, (bucket_key, _, _) in zip(("requests", "tokens"), self._buckets(0)):
+            limit = _to_float(headers.get(f"x-ratelimit-limit-{key}"))
+            remaining = _to_float(headers.get(f"x-ratelimit-remaining-{key}"))
+            attr = "rpm" if key == "requests" else "tpm"
+            # Providers differ in the window behind the limit header (Groq reports requests per day),
+            # so a header may only tighten the configured per-minute budget.
+            if limit and limit < getattr(self, attr):
+                setattr(self, attr, limit)
+            if remaining is not None:
+                self.backend.clamp_tokens(bucket_key, remaining, getattr(self, attr))
+        self._notify()
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class RequestScheduler:
+    """
+    Client-side scheduler: one RateLimiter per model, created from Config.RATE_LIMITS, with budgets
+    kept in the given state backend.
+    """
+    def __init__(self, limits: Dict[str, Dict[str, float]], default_limits: Dict[str, float], backend):
+        self.limits = limits
+        self.default_limits = default_limits
+        self.backend = backend
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model: str) -> RateLimiter:
+        with self._lock:
+            if model not in self._limiters:
+                cfg = self.limits.get(model, self.default_limits)
+                self._limiters[model] = RateLimiter(model, cfg["rpm"], cfg["tpm"], self.backend)
+            return self._limiters[model]
+
+    def acquire(self, model: str, tokens: float, priority: int = BACKGROUND):
+        self.limiter(model).acquire(tokens, priority)
+
+    async def aacquire(self, model: str, tokens: float, priority: int = BACKGROUND):
+        await self.limiter(model).acquire_async(tokens, priority)
+
+    @staticmethod
+    def _rate_limit_headers(response: Any) -> Optional[Dict[str, str]]:
+        hidden = getattr(response, "_hidden_params", None) or {}
+        headers = hidden.get("additional_headers") or getattr(response, "_response_headers", None) or {}
+        normalized = {k.lower().replace("llm_provider-", ""): v for k, v in dict(headers).items()}
+        return normalized if any(k.startswith("x-ratelimit-") for k in normalized) else None
+
+    def observe(self, model: str, response: Any):
+        """
+        Reads rate-limit headers from a litellm response, if the provider sent any.
+        """
+        headers = self._rate_limit_headers(response)
+        if headers:
+            self.limiter(model).update(headers)
+
+    async def aobserve(self, model: str, response: Any):
+        # Applying headers clamps buckets in the state backend, which may block: keep it off the loop
+        headers = self._rate_limit_headers(response)
+        if headers:
+            await asyncio.to_thread(self.limiter(model).update, headers)
+
+    def observe_error(self, model: str, error: Exception):
+        """
+        Backs off the model after a 429, honouring Retry-After when present.
+        """
+        if getattr(error, "status_code", None) != 429:
+            return
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None and getattr(response, "headers", None) is not None:
+            retry_after = _to_float(response.headers.get("retry-after"))
+        self.limiter(model).pause(retry_after or 10.0)
+
+def estimate_tokens(messages: Any = None, tools: Any = None, completion_tokens: int = 0) -> int:
+    """
+    Rough token estimate (~4 characters per token) used to charge the TPM bucket before a call.
+    """
+    chars = 0
+    for part in (messages, tools):
+        if not part:
+            continue
+        chars += len(part) if isinstance(part, str) else len(json.dumps(part, default=str, ensure_ascii=False))
+    return chars // 4 + completion_tokens
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+scheduler = RequestScheduler(Config.RATE_LIMITS, Config.DEFAULT_RATE_LIMIT, state_backend)
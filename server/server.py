@@ -1,144 +1,127 @@
-import os
+import asyncio
 import json
-import datetime
-import warnings
-import logging
-import logging
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from collections import deque
 
 from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from litellm import completion, embedding
-import litellm
+import clients
+from config import Config
+from memory import AlphredMemory
 from prompts import get_system_prompt
+from router import ModelRouter
+from scheduler import INTERACTIVE
 
-# 1. 시스템 설정 및 경고 억제
-load_dotenv()
-warnings.filterwarnings("ignore")
-logging.getLogger("litellm").setLevel(logging.ERROR)
-litellm.telemetry = False
-litellm.drop_params = True
+# 1. 시스템 설정
+# litellm / supabase 는 clients 모듈에서 최초 사용 시 로드됩니다 (콜드 스타트 단축).
 
-class Config:
-    SUPABASE_URL = os.getenv("SUPABASE_URL")
-    SUPABASE_SECRET_KEY = os.getenv("SUPABASE_SECRET_KEY")
-    ACCESS_TOKEN = os.getenv("ALPHRED_ACCESS_TOKEN")
-    DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "groq/llama-3.3-70b-versatile")
-    GEMINI_MODEL = "gemini/gemini-1.5-flash"
-    EMBEDDING_MODEL = "gemini/text-embedding-004"
-    SEARCH_THRESHOLD = 0.35
-
-# Supabase 클라이언트 초기화
-supabase: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_SECRET_KEY)
+# --- API 서버 설정 ---
 
-# --- Alphred 메모리 엔진 ---
+from skills.manager import SkillManager
+skill_manager = SkillManager()
+router = ModelRouter(Config.ROUTER_MODELS)
 
-# --- Alphred 메모리 엔진 ---
+# 메모리 엔진은 동기 코드이며 레이트 리밋 대기 중 스레드를 점유합니다.
+# 기본 스레드 풀을 고갈시키지 않도록 전용 풀을 쓰고, 조회(대화 중)와 저장(백그라운드)을 분리합니다.
+retrieval_pool = ThreadPoolExecutor(max_workers=Config.MEMORY_THREADS, thread_name_prefix="memory-retrieve")
+store_pool = ThreadPoolExecutor(max_workers=Config.MEMORY_THREADS, thread_name_prefix="memory-store")
 
-class AlphredMemory:
-    short_term_cache = deque(maxlen=10)
-    
-    @staticmethod
-    def format_memory_content(timestamp, role, content) -> str:
-        """
-        Formats memory unified: [YYYY-MM-DD HH:MM:ss] Role: Content
-        Parses ISO timestamp if string.
-        """
-        try:
-            if isinstance(timestamp, str):
-                dt = datetime.datetime.fromisoformat(timestamp)
-            else:
-                dt = timestamp
-            ts_str = dt.strftime("%Y-%m-%d %H:%M:%S")
-        except:
-            ts_str = str(timestamp)
-            
-        # Normalize role for display
-        display_role = "User" if role.lower() == "user" else "AI"
-        return f"[{ts_str}] {display_role}: {content}"
-
-    @staticmethod
-    def initialize_cache():
+def store_turn(user_input, answer):
+    # Runs in store_pool after the reply is sent; one task per turn keeps User before AI in STM
+    try:
+        AlphredMemory.store("User", user_input)
+        AlphredMemory.store("AI", answer)
+    except Exception as e:
+        print(f"[Memory] Failed to store turn: {e}")
+
+class StartupState:
+    """
+    Tracks background warm-up so the server can accept traffic immediately.
+    Each component is 'pending', 'ok' or 'error'. Required components are retried until they
+    succeed; the server is not ready while one of them is in error.
+    """
+    REQUIRED = ("stm", "providers")
+
+    def __init__(self):
+        self.components = {"stm": "pending", "providers": "pending", "skills": "pending"}
+        self.ready = asyncio.Event()
+        # STM + providers: enough to answer /chat, possibly with reduced tools
+        self.core_ready = asyncio.Event()
+        self.skills_ready = asyncio.Event()
+        self.stop = asyncio.Event()
+
+    async def _step(self, name, coro):
         try:
-            res = supabase.table("memories").select("role", "content", "created_at").order("created_at", desc=True).limit(50).execute()
-            for h in res.data[::-1]:
-                role = "user" if h['role'] in ["User", "user"] else "assistant"
-                # STM Format: [Time] Role: Content
-                formatted_content = AlphredMemory.format_memory_content(h['created_at'], role, h['content'])
-                AlphredMemory.short_term_cache.append({"role": role, "content": formatted_content})
+            await coro
+            self.components[name] = "ok"
         except Exception as e:
-            print(f"[Memory Init Error] {e}")
-
-    @staticmethod
-    def get_embedding(text):
-        try:
-            res = embedding(model=Config.EMBEDDING_MODEL, input=[text])
-            return res.data[0]['embedding']
-        except: return None
-
-    @staticmethod
-    def retrieve_long_term(query):
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        try:
-            it_res = completion(
-                model=Config.GEMINI_MODEL,
-                messages=[{"role": "system", "content": f"현재 시간 {now}. 시간범위를 JSON으로 분석."},
-                          {"role": "user", "content": query}],
-                response_format={"type": "json_object"}
-            )
-            it = json.loads(it_res.choices[0].message.content)
-            vec = AlphredMemory.get_embedding(query)
-            if not vec: return ""
-            res = supabase.rpc("match_memories", {
-                "query_embedding": vec, "match_threshold": Config.SEARCH_THRESHOLD, "match_count": 5,
-                "from_date": it.get("from_date", "-infinity"), "to_date": it.get("to_date", "infinity")
-            }).execute()
-            if not res.data: return ""
-            ctx = "\n[관련된 장기 기억 기록]\n"
-            for m in res.data:
-                # LTM Format: [Time] Role: Content
-                line = AlphredMemory.format_memory_content(m['created_at'], m['role'], m['content'])
-                ctx += f"- {line}\n"
-            return ctx
-        except: return ""
-
-    @staticmethod
-    def store(role, content):
-        # Database: Store raw content
-        now = datetime.datetime.now()
-        vec = AlphredMemory.get_embedding(content)
-        
-        # Cache: Store formatted content
-        cache_role = "user" if role in ["User", "user"] else "assistant"
-        formatted_content = AlphredMemory.format_memory_content(now, cache_role, content)
-        AlphredMemory.short_term_cache.append({"role": cache_role, "content": formatted_content})
-        
-        if vec:
-            try: supabase.table("memories").insert({
-                "role": role, 
-                "content": content,  # Raw content in DB
-                "embedding": vec, 
-                "created_at": now.isoformat()
-            }).execute()
-            except: pass
-
-# --- API 서버 설정 ---
-
-from skills.manager import SkillManager
-skill_manager = SkillManager()
+            self.components[name] = "error"
+            print(f"[Startup] {name} failed: {e}")
+
+    async def run_skills(self):
+        # MCP sessions must be opened and closed by the same task (anyio cancel scopes),
+        # so this task owns the skill lifecycle until shutdown.
+        await self._step("skills", skill_manager.activate_skill(Config.STARTUP_SKILL))
+        self.skills_ready.set()
+        await self.stop.wait()
+        await skill_manager.shutdown()
+
+    async def _retry(self, name, fn, delay=1.0, max_delay=30.0):
+        while self.components[name] == "error":
+            try:
+                await asyncio.wait_for(self.stop.wait(), timeout=delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+            await self._step(name, asyncio.to_thread(fn))
+            delay = min(delay * 2, max_delay)
+
+    async def warm_up(self):
+        steps = {"stm": AlphredMemory.initialize_cache, "providers": clients.warm_up}
+        await asyncio.gather(*(self._step(name, asyncio.to_thread(fn)) for name, fn in steps.items()))
+        # /chat may proceed after the first attempt; it reports its own errors per request
+        self.core_ready.set()
+        await asyncio.gather(self.skills_ready.wait(), *(self._retry(name, fn) for name, fn in steps.items()))
+        self.ready.set()
+
+    @property
+    def is_ready(self):
+        return self.ready.is_set() and all(self.components[name] == "ok" for name in self.REQUIRED)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    AlphredMemory.initialize_cache()
-    await skill_manager.activate_skill("task_manager")
+    startup = StartupState()
+    app.state.startup = startup
+    skills_task = asyncio.create_task(startup.run_skills())
+    warmup_task = asyncio.create_task(startup.warm_up())
     yield
-    await skill_manager.shutdown()
+    warmup_task.cancel()
+    startup.stop.set()
+    await skills_task
+    retrieval_pool.shutdown(wait=False, cancel_futures=True)
+    store_pool.shutdown(wait=True)
 
 app = FastAPI(title="Alphred API v3.1", lifespan=lifespan)
 
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    startup = app.state.startup
+    ready = startup.is_ready
+    if not ready:
+        status = "starting"
+    elif startup.components["skills"] == "error":
+        # MCP servers failed: /chat still answers, with fewer tools
+        status = "degraded"
+    else:
+        status = "ready"
+    body = {"status": status, "components": startup.components, "models": router.snapshot()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 class ChatRequest(BaseModel):
     message: str
 
@@ -152,11 +135,25 @@ async def chat_endpoint(request: ChatRequest, x_alphred_token: str = Header(None
     if not x_alphred_token or x_alphred_token != Config.ACCESS_TOKEN:
         raise HTTPException(status_code=403, detail="Unauthorized")
 
+    # 요청이 워밍업보다 먼저 도착하면 STM 로드를 기다리되, 시간 초과 시 503을 반환합니다.
+    # MCP 서버 활성화는 기다리지 않습니다 (멈춘 MCP 서버가 모든 요청을 막지 않도록).
+    startup = app.state.startup
+    try:
+        await asyncio.wait_for(startup.core_ready.wait(), timeout=Config.READY_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Server is starting up")
+    if not startup.skills_ready.is_set():
+        print("[Chat] Skills still activating; answering with reduced tools")
+
     user_input = request.message
     mcp_log = []
     
     # 1. 기억 및 컨텍스트 준비
-    lt_ctx = AlphredMemory.retrieve_long_term(user_input)
+    # 레이트 리밋 대기가 이벤트 루프를 막지 않도록 전용 스레드 풀에서 실행
+    # 질의 임베딩은 한 번만 계산해 장기 기억 검색과 도구 선택에 함께 사용
+    loop = asyncio.get_running_loop()
+    query_vec = await loop.run_in_executor(retrieval_pool, AlphredMemory.get_embedding, user_input, INTERACTIVE)
+    lt_ctx = await loop.run_in_executor(retrieval_pool, AlphredMemory.retrieve_long_term, user_input, query_vec)
     is_lt = len(lt_ctx) > 0
     
     # 2. **업그레이드된 시스템 프롬프트 (High-Level Persona)**
@@ -166,24 +163,33 @@ async def chat_endpoint(request: ChatRequest, x_alphred_token: str = Header(None
     system_msg = get_system_prompt(lt_ctx, skill_prompt)
     
     messages = [{"role": "system", "content": system_msg}]
-    messages.extend(list(AlphredMemory.short_term_cache))
+    messages.extend(await loop.run_in_executor(retrieval_pool, AlphredMemory.get_context))
     messages.append({"role": "user", "content": user_input})
 
     try:
-        # Get dynamic tools from active skill
-        tools = await skill_manager.get_tools()
-        
-        response = completion(
-            model=Config.DEFAULT_MODEL,
-            messages=messages,
-            tools=tools if tools else None,
-            tool_choice="auto" if tools else None,
-            fallbacks=[Config.GEMINI_MODEL]
-        )
-        
-        msg = response.choices[0].message
-        
-        if hasattr(msg, 'tool_calls') and msg.tool_calls:
+        # Tools found through search_tools are added to the subset on the next turn
+        expanded = set()
+        answer = None
+
+        for _ in range(Config.CHAT_MAX_TURNS):
+            # Get dynamic tools from active skill
+            tools = await skill_manager.get_tools(query=user_input, extra=expanded,
+                                                  priority=INTERACTIVE, query_vector=query_vec)
+
+            response = await router.acompletion(
+                hedge=Config.HEDGE_REQUESTS,
+                priority=INTERACTIVE,
+                messages=messages,
+                tools=tools if tools else None,
+                tool_choice="auto" if tools else None
+            )
+
+            msg = response.choices[0].message
+
+            if not (hasattr(msg, 'tool_calls') and msg.tool_calls):
+                answer = msg.content
+                break
+
             messages.append(msg)
             for tool in msg.tool_calls:
                 name = tool.function.name
@@ -191,17 +197,17 @@ async def chat_endpoint(request: ChatRequest, x_alphred_token: str = Header(None
                 # LiteLLM/OpenAI usually gives string in arguments.
                 args = json.loads(tool.function.arguments)
                 mcp_log.append(name)
-                
-                result = await skill_manager.dispatch_tool_call(name, args)
+
+                result = await skill_manager.dispatch_tool_call(name, args, expanded=expanded, priority=INTERACTIVE)
                 messages.append({"tool_call_id": tool.id, "role": "tool", "name": name, "content": str(result)})
-            
-            final_res = completion(model=Config.DEFAULT_MODEL, messages=messages)
+
+        if answer is None:
+            # Turn limit reached: answer from the tool results gathered so far
+            final_res = await router.acompletion(hedge=Config.HEDGE_REQUESTS, priority=INTERACTIVE, messages=messages)
             answer = final_res.choices[0].message.content
-        else:
-            answer = msg.content
 
-        AlphredMemory.store("User", user_input)
-        AlphredMemory.store("AI", answer)
+        # Embedding runs at the lowest priority, so the reply does not wait for the store
+        store_pool.submit(store_turn, user_input, answer)
         return ChatResponse(reply=answer, long_term_searched=is_lt, mcp_used=mcp_log)
     except Exception as e:
         # print error stacktrace for debugging
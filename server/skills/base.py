@@ -16,6 +16,8 @@ class Skill:
         #   "args": ["-y", "@modelcontextprotocol/server-filesystem", "..."],
         #   "env": {...} (Optional)
         # }
+        # Tool names always sent to the model, regardless of relevance selection
+        self.pinned_tools: List[str] = []
 
     def get_system_prompt(self) -> str:
         return self.system_prompt
@@ -1,7 +1,6 @@
 from typing import Dict, Any, List
 from skills.base import Skill
-from supabase import create_client
-import os
+import clients
 
 class SkillImpl(Skill):
     def __init__(self):
@@ -16,11 +15,11 @@ class SkillImpl(Skill):
             "- Do NOT try to execute code yourself. Always delegate."
         )
         self.mcp_servers = [] # This skill uses direct DB access, not an external MCP server for now.
-        
-        # Init DB client for this skill
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_SECRET_KEY")
-        self.db = create_client(url, key)
+
+    @property
+    def db(self):
+        # Resolved lazily so loading skill definitions stays cheap at startup
+        return clients.get_supabase()
 
     async def create_task(self, title: str, description: str) -> str:
         """Creates a new task for the Worker."""
@@ -1,8 +1,11 @@
 import asyncio
+import json
 import os
 import importlib.util
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Set
 from skills.base import Skill
+from skills.selector import ToolSelector, SEARCH_TOOLS
+from scheduler import INTERACTIVE
 from mcp_client.session import MCPClientSession
 from contextlib import AsyncExitStack
 
@@ -15,6 +18,10 @@ class SkillManager:
         self.active_skill: Optional[Skill] = None
         self.exit_stack = AsyncExitStack()
         self.active_sessions: List[MCPClientSession] = []
+        # MCP tool schemas and tool -> session routing, listed once per activation
+        self._mcp_tools: List[Dict[str, Any]] = []
+        self._tool_sessions: Dict[str, MCPClientSession] = {}
+        self.selector = ToolSelector()
         self._load_skills()
 
     def _load_skills(self):
@@ -74,11 +81,17 @@ class SkillManager:
                 self.active_sessions.append(session)
             except Exception as e:
                 print(f"[SkillManager] Failed to connect to server {server_config}: {e}")
-                
-    async def get_tools(self) -> List[Dict[str, Any]]:
-        """
-        Returns a list of tools from all active sessions in OpenAI format.
-        """
+
+        # 4. Cache tool schemas so requests don't re-list every server
+        for session in self.active_sessions:
+            try:
+                for tool in await session.list_tools_openai_format():
+                    self._mcp_tools.append(tool)
+                    self._tool_sessions[tool["function"]["name"]] = session
+            except Exception as e:
+                print(f"[SkillManager] Error listing tools: {e}")
+
+    async def _all_tools(self) -> List[Dict[str, Any]]:
         all_tools = []
         
         # 1. Add local tools if any
@@ -93,30 +106,51 @@ class SkillManager:
                 all_tools.extend(local_tools)
 
         # 2. Add MCP tools
-        for session in self.active_sessions:
-            try:
-                tools = await session.list_tools_openai_format()
-                all_tools.extend(tools)
-            except Exception as e:
-                print(f"[SkillManager] Error listing tools: {e}")
+        all_tools.extend(self._mcp_tools)
         return all_tools
+
+    async def get_tools(self, query: Optional[str] = None, extra: Optional[Set[str]] = None,
+                        priority: int = INTERACTIVE, query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """
+        Returns tools from all active sessions in OpenAI format.
+        With a query, only the skill's pinned tools, `extra` tools and the most relevant ones are
+        returned, plus a search_tools fallback for reaching the rest. Embedding calls run at the
+        caller's `priority`; pass `query_vector` if the query was already embedded.
+        """
+        all_tools = await self._all_tools()
+        if not query:
+            return all_tools
+        pinned = getattr(self.active_skill, "pinned_tools", [])
+        return await self.selector.select(query, all_tools, pinned=pinned, extra=extra or (),
+                                          priority=priority, query_vector=query_vector)
         
-    async def dispatch_tool_call(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+    async def dispatch_tool_call(self, tool_name: str, arguments: Dict[str, Any], expanded: Optional[Set[str]] = None,
+                                 priority: int = INTERACTIVE) -> Any:
         """
         Message routing: Finds the server that has this tool and executes it.
+        Any tool of the active skill can be called, even if it was not in the selected subset.
         """
+        # 0. Tool search fallback: found tools are added to `expanded` for the next turn
+        if tool_name == SEARCH_TOOLS:
+            found = await self.selector.search(arguments.get("query", ""), await self._all_tools(), priority=priority)
+            if expanded is not None:
+                expanded.update(t["function"]["name"] for t in found)
+            return json.dumps([t["function"] for t in found], ensure_ascii=False)
+
         # 1. Check if it's a local native tool (e.g. TaskManager)
         if hasattr(self.active_skill, 'dispatch_local'):
             result = await self.active_skill.dispatch_local(tool_name, arguments)
             if result is not None:
                 return result
 
-        # 2. Check active MCP sessions
+        # 2. Route via the cached tool -> session map
+        session = self._tool_sessions.get(tool_name)
+        if session:
+            return await session.call_tool(tool_name, arguments)
+
+        # 3. Fall back to asking each session (tools added after activation)
         for session in self.active_sessions:
             try:
-                # Optimization: We should cache which session has which tool.
-                # For now, we list tools to check if it exists in this session.
-                # This causes overhead but ensures correctness.
                 result = await session.session.list_tools()
                 for tool in result.tools:
                     if tool.name == tool_name:
@@ -133,3 +167,5 @@ class SkillManager:
         if self.exit_stack:
             await self.exit_stack.aclose()
         self.active_sessions = []
+        self._mcp_tools = []
+        self._tool_sessions = {}
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import clients
+from config import Config
+from scheduler import scheduler, estimate_tokens, INTERACTIVE
+from state import state_backend
+
+SEARCH_TOOLS = "search_tools"
+
+SEARCH_TOOLS_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": SEARCH_TOOLS,
+        "description": "Search for additional tools not listed here. Returns matching tool names, descriptions and parameters; any returned tool can then be called by name.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "What the tool should do"}
+            },
+            "required": ["query"]
+        }
+    }
+}
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _tool_text(tool: Dict[str, Any]) -> str:
+    fn = tool["function"]
+    params = ", ".join((fn.get("parameters") or {}).get("properties", {}).keys())
+    return f"{fn['name']}: {fn.get('description') or ''} ({params})"
+
+class ToolSelector:
+    """
+    Picks the top-k tools most relevant to a request so the full MCP tool catalogue
+    is not sent with every completion. Tool description embeddings are computed once
+    and cached in the state backend.
+    """
+    def __init__(self, top_k: int = Config.TOOL_TOP_K):
+        self.top_k = top_k
+        self._vectors: Dict[str, List[float]] = {}
+        # Multi-turn loops select tools for the same query every turn
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def _key(self, tool: Dict[str, Any]) -> str:
+        digest = hashlib.sha1(_tool_text(tool).encode("utf-8")).hexdigest()
+        return f"tool-embedding:{Config.EMBEDDING_MODEL}:{digest}"
+
+    async def _embed(self, texts: List[str], priority: int) -> List[List[float]]:
+        await scheduler.aacquire(Config.EMBEDDING_MODEL, estimate_tokens(texts), priority)
+        try:
+            res = await clients.aembedding(model=Config.EMBEDDING_MODEL, input=texts)
+        except Exception as e:
+            scheduler.observe_error(Config.EMBEDDING_MODEL, e)
+            raise
+        await scheduler.aobserve(Config.EMBEDDING_MODEL, res)
+        return [item["embedding"] for item in res.data]
+
+    async def _tool_vectors(self, tools: List[Dict[str, Any]], priority: int) -> Dict[str, List[float]]:
+        keys = {tool["function"]["name"]: self._key(tool) for tool in tools}
+        unknown = [tool for tool in tools if keys[tool["function"]["name"]] not in self._vectors]
+        missing = []
+        if unknown:
+            # Backend reads may be a SQLite transaction or a Redis round trip: keep them off the loop
+            cached = await asyncio.to_thread(
+                lambda: [state_backend.cache_get(keys[t["function"]["name"]]) for t in unknown])
+            for tool, vec in zip(unknown, cached):
+                if vec is not None:
+                    self._vectors[keys[tool["function"]["name"]]] = vec
+                else:
+                    missing.append(tool)
+
+        # Embed every uncached tool description in one batch
+        if missing:
+            vectors = await self._embed([_tool_text(t) for t in missing], priority)
+            fresh = {keys[tool["function"]["name"]]: vec for tool, vec in zip(missing, vectors)}
+            self._vectors.update(fresh)
+            await asyncio.to_thread(lambda: [state_backend.cache_set(key, vec) for key, vec in fresh.items()])
+
+        return {name: self._vectors[key] for name, key in keys.items()}
+
+    async def rank(self, query: str, tools: List[Dict[str, Any]], priority: int = INTERACTIVE,
+                   query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """
+        Sorts tools by similarity to the query. A `query_vector` the caller already computed
+        (e.g. for memory retrieval) is used and cached instead of embedding the query again.
+        """
+        vectors = await self._tool_vectors(tools, priority)
+        query_vec = query_vector or self._queries.get(query)
+        if query_vec is None:
+            query_vec = (await self._embed([query], priority))[0]
+        if query not in self._queries:
+            self._queries[query] = query_vec
+            if len(self._queries) > 64:
+                self._queries.popitem(last=False)
+        return sorted(tools, key=lambda t: _cosine(query_vec, vectors[t["function"]["name"]]), reverse=True)
+
+    async def select(self, query: str, tools: List[Dict[str, Any]], pinned: Iterable[str] = (),
+                     extra: Iterable[str] = (), priority: int = INTERACTIVE,
+                     query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """
+        Returns pinned tools, explicitly requested `extra` tools and the top-k by relevance,
+        plus the search_tools fallback. Falls back to the full list if embedding fails.
+        """
+        always = set(pinned) | set(extra)
+        if len(tools) <= self.top_k + len(always):
+            return tools
+        try:
+            candidates = [t for t in tools if t["function"]["name"] not in always]
+            ranked = await self.rank(query, candidates, priority, query_vector)
+        except Exception as e:
+            print(f"[ToolSelector] Selection failed, sending all tools: {e}")
+            return tools
+        selected = [t for t in tools if t["function"]["name"] in always] + ranked[:self.top_k]
+        return selected + [SEARCH_TOOLS_SCHEMA]
+
+    async def search(self, query: str, tools: List[Dict[str, Any]], limit: Optional[int] = None,
+                     priority: int = INTERACTIVE) -> List[Dict[str, Any]]:
+        """
+        Backs the search_tools call. Falls back to keyword matching on tool names and
+        descriptions if embedding fails, so the model's fallback never errors out.
+        """
+        limit = limit or self.top_k
+        try:
+            return (await self.rank(query, tools, priority))[:limit]
+        except Exception as e:
+            print(f"[ToolSelector] Search failed, matching keywords instead: {e}")
+        words = [w for w in query.lower().split() if w]
+        scored = [(sum(w in _tool_text(t).lower() for w in words), i, t) for i, t in enumerate(tools)]
+        return [t for score, _, t in sorted(scored, key=lambda s: (-s[0], s[1])) if score][:limit]
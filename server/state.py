@@ -0,0 +1,385 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+
+# Identifies this process in task / leader claims
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def _refill(level: float, updated: float, per_minute: float, now: float) -> float:
+    return min(per_minute, level + (now - updated) * per_minute / 60.0)
+
+def _take(state: Dict[str, Tuple[float, float]], buckets: List[Tuple[str, float, float]], now: float) -> float:
+    """
+    All-or-nothing take over (key, amount, per_minute) buckets; `state` maps key -> (level, updated)
+    and is updated in place. Returns 0 on success, else seconds until every bucket has room.
+    """
+    levels = {}
+    wait = 0.0
+    for key, amount, per_minute in buckets:
+        level, updated = state.get(key, (per_minute, now))
+        levels[key] = _refill(level, updated, per_minute, now)
+        amount = min(amount, per_minute)
+        if levels[key] < amount:
+            wait = max(wait, (amount - levels[key]) * 60.0 / per_minute)
+    for key, amount, per_minute in buckets:
+        taken = 0.0 if wait > 0 else min(amount, per_minute)
+        state[key] = (levels[key] - taken, now)
+    return wait
+
+class StateBackend(ABC):
+    """
+    Abstract base for shared runtime state: conversation context (STM), a TTL cache, expiring claims
+    and the provider rate-limit token buckets.
+    The in-process default is enough for a single uvicorn worker; use a shared backend for
+    `uvicorn --workers N` or several replicas so every process sees the same conversation.
+    """
+    @abstractmethod
+    def append_context(self, entry: Dict[str, str], maxlen: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace_context(self, entries: List[Dict[str, str]], maxlen: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_context(self, limit: int) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def cache_get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, key: str, owner: str = OWNER_ID, ttl: float = 60.0) -> bool:
+        """
+        Takes (or renews) an expiring claim. Returns False if another owner holds it.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, key: str, owner: str = OWNER_ID):
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_tokens(self, buckets: List[Tuple[str, float, float]]) -> float:
+        """
+        Atomically takes `amount` from every (key, amount, per_minute) token bucket, or nothing.
+        Returns 0 on success, else the seconds until all buckets could cover the request.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def clamp_tokens(self, key: str, level: float, per_minute: float):
+        """
+        Lowers a token bucket to at most `level` (e.g. a provider's remaining-quota header).
+        """
+        raise NotImplementedError
+
+class InProcessBackend(StateBackend):
+    def __init__(self):
+        self._context: deque = deque()
+        self._cache: Dict[str, tuple] = {}
+        self._claims: Dict[str, tuple] = {}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def append_context(self, entry, maxlen):
+        with self._lock:
+            self._context.append(entry)
+            while len(self._context) > maxlen:
+                self._context.popleft()
+
+    def replace_context(self, entries, maxlen):
+        with self._lock:
+            self._context = deque(entries[-maxlen:])
+
+    def get_context(self, limit):
+        with self._lock:
+            return list(self._context)[-limit:]
+
+    def cache_get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._cache[key]
+                return None
+            return value
+
+    def cache_set(self, key, value, ttl=None):
+        with self._lock:
+            self._cache[key] = (value, time.time() + ttl if ttl else None)
+
+    def claim(self, key, owner=OWNER_ID, ttl=60.0):
+        now = time.time()
+        with self._lock:
+            current = self._claims.get(key)
+            if current and current[0] != owner and current[1] > now:
+                return False
+            self._claims[key] = (owner, now + ttl)
+            return True
+
+    def release(self, key, owner=OWNER_ID):
+        with self._lock:
+            if self._claims.get(key, (None,))[0] == owner:
+                del self._claims[key]
+
+    def take_tokens(self, buckets):
+        with self._lock:
+            return _take(self._buckets, buckets, time.time())
+
+    def clamp_tokens(self, key, level, per_minute):
+        now = time.time()
+        with self._lock:
+            current, updated = self._buckets.get(key, (per_minute, now))
+            self._buckets[key] = (min(_refill(current, updated, per_minute, now), level), now)
+
+class SQLiteBackend(StateBackend):
+    """
+    Shared state in a SQLite database in WAL mode. Works across uvicorn workers and other processes
+    on the same host. WAL relies on shared memory, so the file must be on a local disk: do not put
+    it on a network filesystem or share it between hosts (use RedisBackend for that).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS context (id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT, content TEXT);
+            CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL);
+            CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT, expires_at REAL);
+            CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, level REAL, updated REAL);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append_context(self, entry, maxlen):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO context (role, content) VALUES (?, ?)", (entry["role"], entry["content"]))
+            conn.execute("DELETE FROM context WHERE id <= (SELECT MAX(id) FROM context) - ?", (maxlen,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def replace_context(self, entries, maxlen):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM context")
+            conn.executemany("INSERT INTO context (role, content) VALUES (?, ?)",
+                             [(e["role"], e["content"]) for e in entries[-maxlen:]])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_context(self, limit):
+        rows = self._conn().execute(
+            "SELECT role, content FROM (SELECT id, role, content FROM context ORDER BY id DESC LIMIT ?) ORDER BY id",
+            (limit,)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def cache_get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_set(self, key, value, ttl=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None)
+        )
+
+    def claim(self, key, owner=OWNER_ID, ttl=60.0):
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO claims (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE claims.expires_at < ? OR claims.owner = excluded.owner",
+            (key, owner, now + ttl, now)
+        )
+        return cur.rowcount == 1
+
+    def release(self, key, owner=OWNER_ID):
+        self._conn().execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner))
+
+    def _locked_buckets(self, keys, fn):
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            marks = ",".join("?" * len(keys))
+            rows = conn.execute(f"SELECT key, level, updated FROM buckets WHERE key IN ({marks})", list(keys)).fetchall()
+            state = {key: (level, updated) for key, level, updated in rows}
+            result = fn(state)
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)",
+                             [(key, level, updated) for key, (level, updated) in state.items()])
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def take_tokens(self, buckets):
+        return self._locked_buckets([b[0] for b in buckets], lambda state: _take(state, buckets, time.time()))
+
+    def clamp_tokens(self, key, level, per_minute):
+        def clamp(state):
+            now = time.time()
+            current, updated = state.get(key, (per_minute, now))
+            state[key] = (min(_refill(current, updated, per_minute, now), level), now)
+        self._locked_buckets([key], clamp)
+
+_REDIS_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local amount = math.min(tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i]))
+    local cap = tonumber(ARGV[2 * i])
+    local v = redis.call('HMGET', key, 'level', 'updated')
+    local level = tonumber(v[1]) or cap
+    local updated = tonumber(v[2]) or now
+    levels[i] = math.min(cap, level + (now - updated) * cap / 60)
+    if levels[i] < amount then wait = math.max(wait, (amount - levels[i]) * 60 / cap) end
+end
+for i, key in ipairs(KEYS) do
+    local taken = 0
+    if wait <= 0 then taken = math.min(tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])) end
+    redis.call('HSET', key, 'level', tostring(levels[i] - taken), 'updated', tostring(now))
+    redis.call('EXPIRE', key, 3600)
+end
+return tostring(wait)
+"""
+
+_REDIS_CLAMP = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cap = tonumber(ARGV[2])
+local v = redis.call('HMGET', KEYS[1], 'level', 'updated')
+local level = tonumber(v[1]) or cap
+local updated = tonumber(v[2]) or now
+level = math.min(cap, level + (now - updated) * cap / 60, tonumber(ARGV[1]))
+redis.call('HSET', KEYS[1], 'level', tostring(level), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return 1
+"""
+
+_REDIS_CLAIM = """
+local current = redis.call('GET', KEYS[1])
+if (not current) or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_REDIS_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class RedisBackend(StateBackend):
+    """
+    Shared state in any Redis-protocol server (Redis, Valkey, KeyDB, ...). Works across processes
+    and hosts. Token buckets and claims are updated by Lua scripts, so they are atomic server-side
+    and use the server's clock.
+    """
+    def __init__(self, url: str, prefix: str = "alphred:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RedisBackend requires the 'redis' package (pip install redis)") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._take = self.client.register_script(_REDIS_TAKE)
+        self._clamp = self.client.register_script(_REDIS_CLAMP)
+        self._claim = self.client.register_script(_REDIS_CLAIM)
+        self._release = self.client.register_script(_REDIS_RELEASE)
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def append_context(self, entry, maxlen):
+        pipe = self.client.pipeline()
+        pipe.rpush(self._k("context"), json.dumps(entry, ensure_ascii=False))
+        pipe.ltrim(self._k("context"), -maxlen, -1)
+        pipe.execute()
+
+    def replace_context(self, entries, maxlen):
+        pipe = self.client.pipeline()  # MULTI/EXEC
+        pipe.delete(self._k("context"))
+        if entries:
+            pipe.rpush(self._k("context"), *[json.dumps(e, ensure_ascii=False) for e in entries[-maxlen:]])
+        pipe.execute()
+
+    def get_context(self, limit):
+        return [json.loads(item) for item in self.client.lrange(self._k("context"), -limit, -1)]
+
+    def cache_get(self, key):
+        value = self.client.get(self._k(f"cache:{key}"))
+        return json.loads(value) if value is not None else None
+
+    def cache_set(self, key, value, ttl=None):
+        self.client.set(self._k(f"cache:{key}"), json.dumps(value, ensure_ascii=False),
+                        px=int(ttl * 1000) if ttl else None)
+
+    def claim(self, key, owner=OWNER_ID, ttl=60.0):
+        return bool(self._claim(keys=[self._k(f"claim:{key}")], args=[owner, int(ttl * 1000)]))
+
+    def release(self, key, owner=OWNER_ID):
+        self._release(keys=[self._k(f"claim:{key}")], args=[owner])
+
+    def take_tokens(self, buckets):
+        args = []
+        for _, amount, per_minute in buckets:
+            args.extend([amount, per_minute])
+        return float(self._take(keys=[self._k(f"bucket:{key}") for key, _, _ in buckets], args=args))
+
+    def clamp_tokens(self, key, level, per_minute):
+        self._clamp(keys=[self._k(f"bucket:{key}")], args=[level, per_minute])
+
+def create_state_backend(url: str) -> StateBackend:
+    """
+    'memory' -> InProcessBackend (single process)
+    'sqlite:///path/to/state.db' -> SQLiteBackend (processes on one host)
+    'redis://host:6379/0' -> RedisBackend (processes across hosts)
+    """
+    if url == "memory":
+        return InProcessBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported state backend: {url}")
+
+state_backend = create_state_backend(Config.STATE_BACKEND)
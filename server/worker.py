@@ -1,31 +1,33 @@
 import asyncio
 import os
 import logging
-from supabase import create_client
-from dotenv import load_dotenv
-from litellm import completion
+import clients
+from config import Config
 from skills.manager import SkillManager
 from prompts import get_system_prompt
+from router import ModelRouter
+from scheduler import BACKGROUND
+from state import state_backend
 
 # 1. Setup
-load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [WORKER] - %(message)s')
 logger = logging.getLogger("worker")
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SECRET_KEY = os.getenv("SUPABASE_SECRET_KEY")
-DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "groq/llama-3.3-70b-versatile")
-
-supabase = create_client(SUPABASE_URL, SUPABASE_SECRET_KEY)
+supabase = clients.get_supabase()
 skill_manager = SkillManager()
+# Background work: fallback to the next healthy model, but no hedging
+router = ModelRouter(Config.ROUTER_MODELS)
 
 async def process_task(task):
     task_id = task['id']
     logger.info(f"Processing Task {task_id}: {task['title']}")
     
     try:
-        # 1. Update status to IN_PROGRESS
-        supabase.table("tasks").update({"status": "in_progress"}).eq("id", task_id).execute()
+        # 1. Update status to IN_PROGRESS (only if still pending, in case another worker got there first)
+        claimed = supabase.table("tasks").update({"status": "in_progress"}).eq("id", task_id).eq("status", "pending").execute()
+        if not claimed.data:
+            logger.info(f"Task {task_id} already taken by another worker.")
+            return
         
         # 2. Setup Context (Activate Skill)
         # For now, Worker uses 'general' skill or we can determine skill from task type.
@@ -47,7 +49,8 @@ async def process_task(task):
             {"role": "user", "content": task_prompt}
         ]
         
-        tools = await skill_manager.get_tools()
+        # Tools found through search_tools are added to the subset on the next turn
+        expanded = set()
         
         # 4. LLM Execution Loop (Simple Single-Turn or Multi-Turn)
         # We need a loop to handle tool calls.
@@ -55,8 +58,9 @@ async def process_task(task):
         final_result = ""
         
         for _ in range(MAX_TURNS):
-            response = completion(
-                model=DEFAULT_MODEL,
+            tools = await skill_manager.get_tools(query=task_prompt, extra=expanded, priority=BACKGROUND)
+            response = await router.acompletion(
+                priority=BACKGROUND,
                 messages=messages,
                 tools=tools if tools else None,
                 tool_choice="auto" if tools else None
@@ -72,7 +76,7 @@ async def process_task(task):
                     args = json.loads(tool.function.arguments)
                     logger.info(f"Tool Call: {name} {args}")
                     
-                    result = await skill_manager.dispatch_tool_call(name, args)
+                    result = await skill_manager.dispatch_tool_call(name, args, expanded=expanded, priority=BACKGROUND)
                     messages.append({"tool_call_id": tool.id, "role": "tool", "name": name, "content": str(result)})
             else:
                 final_result = msg.content
@@ -99,10 +103,15 @@ async def worker_loop():
     while True:
         try:
             # Poll for pending tasks
-            res = supabase.table("tasks").select("*").eq("status", "pending").order("created_at", desc=False).limit(1).execute()
+            res = supabase.table("tasks").select("*").eq("status", "pending").order("created_at", desc=False).limit(5).execute()
             
-            if res.data:
-                await process_task(res.data[0])
+            # Claim through the shared state backend so parallel workers pick different tasks
+            task = next((t for t in res.data if state_backend.claim(f"task:{t['id']}", ttl=Config.TASK_CLAIM_TTL)), None)
+            if task:
+                try:
+                    await process_task(task)
+                finally:
+                    state_backend.release(f"task:{task['id']}")
             else:
                 await asyncio.sleep(5) # Wait before next poll
                 